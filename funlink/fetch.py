@@ -3,10 +3,18 @@
 #!/usr/bin/env python
 
 import sys
-import requests
 import time
+import requests
 import csv
+import threading
 import concurrent.futures
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from requests_cache import CachedSession
+except ImportError:  # Caching is optional; fall back to a plain session
+    CachedSession = None
 
 # UniProt API endpoint
 UNIPROT_URL = "https://rest.uniprot.org/uniprotkb/stream"
@@ -31,92 +39,163 @@ FIELDS = "accession,reviewed,id,protein_name,gene_names,organism_name,length,gen
 # Fields that contain IDs (must be separated)
 ID_FIELDS = ["ec", "go_p", "go_c", "go", "go_f", "go_id", "rhea", "keyword", "keywordid"]
 
-BATCH_SIZE = 10  # Increased batch size for efficiency
+BATCH_SIZE = 25  # IDs per stream query; fewer round trips to UniProt
 MAX_RETRIES = 3  # Retry up to 3 times if API fails
-
-
-def fetch_uniprot_data(uniprot_batch):
-    """Fetches UniProt data for a batch of IDs, ensuring all IDs are returned."""
+REQUEST_TIMEOUT = (5, 60)  # (connect, read) timeout in seconds
+MAX_WORKERS = 10  # Concurrent batch requests
+REQUESTS_PER_SECOND = 10  # Stay under UniProt's rate limit to avoid 429 stalls
+MAX_ROUNDS = 5  # Give up on IDs still missing after this many resubmissions
+WRITE_BUFFER_SIZE = 1 << 20  # 1 MiB output buffer; fewer write() syscalls for wide rows
+
+# Heavily annotated entries and long sequences exceed csv's default 128 KiB field limit
+csv.field_size_limit(2**31 - 1)
+
+CACHE_NAME = "uniprot_cache"  # SQLite file holding cached UniProt responses
+CACHE_EXPIRE = 86400  # Re-fetch cached responses after one day
+
+# Shared session so keep-alive connections are reused across all batches,
+# and repeated runs are served from the local cache when requests_cache is installed
+if CachedSession is not None:
+    SESSION = CachedSession(CACHE_NAME, backend="sqlite", allowable_codes=(200,),
+                            expire_after=CACHE_EXPIRE, stale_if_error=True)
+else:
+    SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=MAX_RETRIES, backoff_factor=0.5,
+                      status_forcelist=[429, 500, 502, 503, 504])  # Honors Retry-After on 429
+))
+
+
+class RateLimiter:
+    """Token bucket shared by all worker threads."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request token is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
+
+def drop_cached_response(response):
+    """Removes a response from the cache so the same query is sent to UniProt again."""
+    if CachedSession is not None:
+        SESSION.cache.delete(requests=[response.request])
+
+
+def fetch_uniprot_data(uniprot_batch, refresh=False):
+    """
+    Fetches UniProt data for a batch of IDs, returning the header, rows and any missing IDs.
+    With refresh set, the cache is bypassed so a resubmitted batch always reaches the server.
+    """
     params = {
         "query": " OR ".join(f"accession:{uid}" for uid in uniprot_batch),
         "fields": FIELDS,
         "format": "tsv"
     }
-
-    attempt = 0
-    while attempt < MAX_RETRIES:  # Retry up to MAX_RETRIES if API fails
-        response = requests.get(UNIPROT_URL, params=params)
-
-        if response.status_code == 200:
-            result = response.text.strip().split("\n")
-            retrieved_ids = {line.split("\t")[0] for line in result[1:]}  # Extract returned IDs
-
-            # Check if all requested IDs are present
-            missing_ids = set(uniprot_batch) - retrieved_ids
-            if missing_ids:
-                print(f"Warning: Missing {len(missing_ids)} IDs in batch, retrying missing IDs...")
-                return None, list(missing_ids)  # Return missing IDs for retrying
-            return response.text, []  # Return valid response with no missing IDs
-        elif response.status_code == 429:  # Too many requests
-            print("Rate limit exceeded, waiting 5 seconds before retrying...")
-            time.sleep(5)
-        else:
-            print(f"Error: {response.status_code} - {response.text}")
-            return None, uniprot_batch  # Return all IDs for retrying if an error occurs
-        attempt += 1
-    return None, uniprot_batch  # Return all IDs for retrying if all retries fail
+    cache_options = {"force_refresh": True} if refresh and CachedSession is not None else {}
+
+    try:
+        RATE_LIMITER.acquire()
+        with SESSION.get(UNIPROT_URL, params=params, timeout=REQUEST_TIMEOUT, stream=True,
+                         **cache_options) as response:
+            if response.status_code != 200:
+                print(f"Error: {response.status_code} - {response.text}")
+                return None, [], uniprot_batch  # Return all IDs for retrying if an error occurs
+
+            # Tokenize the TSV as it streams in, collecting returned IDs in the same pass
+            response.encoding = response.encoding or "utf-8"
+            reader = csv.reader(response.iter_lines(decode_unicode=True), delimiter="\t", quoting=csv.QUOTE_NONE)
+            header = next(reader, None)
+            rows = []
+            retrieved_ids = set()
+            for row in reader:
+                if row:
+                    rows.append(row)
+                    retrieved_ids.add(row[0])
+    except requests.RequestException as e:  # Raised once the adapter has used up its retries
+        print(f"Error: {e}")
+        return None, [], uniprot_batch  # Return all IDs for retrying if all retries fail
+    except csv.Error as e:  # Malformed response; treat the batch as failed
+        print(f"Error: could not parse UniProt response - {e}")
+        drop_cached_response(response)
+        return None, [], uniprot_batch
+
+    # Check if all requested IDs are present
+    missing_ids = [uid for uid in uniprot_batch if uid not in retrieved_ids]
+    if missing_ids:
+        print(f"Warning: Missing {len(missing_ids)} IDs in batch, retrying missing IDs...")
+        drop_cached_response(response)  # Don't let a partial answer be served for the next day
+    return header, rows, missing_ids
 
 
 def split_ids_from_descriptions(rows, header):
     """Separates ID fields from descriptions."""
-    updated_rows = []
+    # Build the output header once; ID fields always expand to an _id and a _desc column
     updated_header = []
+    split_flags = []
+    for col_name in header:
+        if col_name in ID_FIELDS:
+            updated_header += [f"{col_name}_id", f"{col_name}_desc"]
+            split_flags.append(True)
+        else:
+            updated_header.append(col_name)
+            split_flags.append(False)
 
+    updated_rows = []
     for row in rows:
         new_row = []
-        for i, value in enumerate(row):
-            col_name = header[i]
-
-            if col_name in ID_FIELDS and ";" in value:  # Split IDs
-                ids = ";".join([x.split(" ")[0] for x in value.split(";")])  # Extract only IDs
-                desc = ";".join([x.split(" ", 1)[1] if " " in x else x for x in value.split(";")])  # Extract descriptions
+        for value, is_id_field in zip(row, split_flags):
+            if is_id_field:  # Split IDs
+                parts = [x.partition(" ") for x in value.split(";")]  # Split each entry once
+                ids = ";".join([p[0] for p in parts])  # Extract only IDs
+                desc = ";".join([p[2] if p[1] else p[0] for p in parts])  # Extract descriptions
                 new_row.append(ids if ids else "no information")
                 new_row.append(desc if desc else "no information")
-
-                if f"{col_name}_id" not in updated_header:  # Add new columns to the header
-                    updated_header.append(f"{col_name}_id")
-                    updated_header.append(f"{col_name}_desc")
             else:
                 new_row.append(value if value else "no information")
-                if col_name not in updated_header:
-                    updated_header.append(col_name)
 
         updated_rows.append(new_row)
 
     return updated_header, updated_rows
 
 
-def process_batch(uniprot_batch, writer, header_written):
+def process_batch(uniprot_batch, writer, writer_lock, header_state, refresh=False):
     """Fetch and process a single batch of UniProt IDs."""
-    result, missing_ids = fetch_uniprot_data(uniprot_batch)
-
-    if result:
-        lines = result.strip().split("\n")
-        raw_header = lines[0].split("\t")
-        rows = [line.split("\t") for line in lines[1:]]
+    raw_header, rows, missing_ids = fetch_uniprot_data(uniprot_batch, refresh=refresh)
 
+    if rows:
         # Process and organize IDs separately
         updated_header, formatted_rows = split_ids_from_descriptions(rows, raw_header)
 
-        # Write header only once
-        if not header_written:
-            writer.writerow(["Unique ID"] + updated_header[1:])  # Rename first column to 'Unique ID'
-            header_written = True
+        # csv.writer is not thread-safe, so serialize writes across workers
+        with writer_lock:
+            # Write header only once
+            if not header_state["written"]:
+                writer.writerow(["Unique ID"] + updated_header[1:])  # Rename first column to 'Unique ID'
+                header_state["written"] = True
 
-        # Write formatted data
-        writer.writerows(formatted_rows)
+            # Write formatted data
+            writer.writerows(formatted_rows)
 
-    return missing_ids, header_written
+    return missing_ids
 
 
 def main(input_file, output_file):
@@ -130,22 +209,31 @@ def main(input_file, output_file):
 
     print(f"Fetching data for {len(uniprot_ids)} UniProt IDs in batches of {BATCH_SIZE}...")
 
-    with open(output_file, "w", newline="") as f:
+    with open(output_file, "w", newline="", buffering=WRITE_BUFFER_SIZE) as f:
         writer = csv.writer(f, delimiter="\t")
-        header_written = False
-        all_missing_ids = uniprot_ids  # Initialize missing_ids with all IDs
-
-        while all_missing_ids:
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                batches = [all_missing_ids[i:i + BATCH_SIZE] for i in range(0, len(all_missing_ids), BATCH_SIZE)]
-                futures = [executor.submit(process_batch, batch, writer, header_written) for batch in batches]
-
-                for future in concurrent.futures.as_completed(futures):
-                    missing_ids, header_written = future.result()
-                    all_missing_ids = missing_ids  # Update remaining missing IDs
-
-            # Be polite to UniProt servers (optional delay)
-            time.sleep(1)
+        writer_lock = threading.Lock()
+        header_state = {"written": False}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            batches = [uniprot_ids[i:i + BATCH_SIZE] for i in range(0, len(uniprot_ids), BATCH_SIZE)]
+            # Map each pending future to the round it was submitted in
+            pending = {executor.submit(process_batch, batch, writer, writer_lock, header_state): 0
+                       for batch in batches}
+
+            # Failed batches resubmit their own missing IDs to the same pool
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    rounds = pending.pop(future)
+                    missing_ids = future.result()
+                    if not missing_ids:
+                        continue
+                    if rounds + 1 >= MAX_ROUNDS:
+                        print(f"Warning: Giving up on {len(missing_ids)} IDs after {MAX_ROUNDS} attempts")
+                        continue
+                    retry = executor.submit(process_batch, list(missing_ids), writer, writer_lock, header_state,
+                                            refresh=True)  # A cached answer would miss the same IDs again
+                    pending[retry] = rounds + 1
 
     print(f"Data successfully saved to {output_file}")
 
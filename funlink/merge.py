@@ -5,73 +5,85 @@
 import pandas as pd
 import argparse
 
-# Set up command-line argument parsing
-parser = argparse.ArgumentParser(description="Merge two TSV files on specified columns.")
-parser.add_argument("merge_results", help="Path to the merge_results.tsv file.")
-parser.add_argument("uniprot_map", help="Path to the uniprot_map.tsv file.")
-parser.add_argument("output", help="Path to save the merged output file.")
+from tsv_io import read_table
 
-# Parse the arguments
-args = parser.parse_args()
 
-# Load merge_results
-merge_results = pd.read_csv(args.merge_results, sep='\t')
+def run(merge_results_path, uniprot_map_path, output, merge_results=None):
+    """Merge BLAST/annotation results with the UniProt map and save the draft database TSV."""
+    # Load merge_results unless the caller already has it in memory
+    if merge_results is None:
+        merge_results = read_table(merge_results_path)
 
-# Ensure 'sseqid' exists before splitting
-if 'sseqid' in merge_results.columns:
-    split_sseqid = merge_results['sseqid'].str.split('|', expand=True).fillna('')
-    merge_results['sseqid_1'] = split_sseqid[0]
-    merge_results['sseqid_2'] = split_sseqid[1]
-    merge_results['sseqid_3'] = split_sseqid[2]
-else:
-    print("Error: Column 'sseqid' not found in merge_results.tsv")
-    exit(1)
+    # Ensure 'sseqid' exists before splitting
+    if 'sseqid' in merge_results.columns:
+        # Only the first three parts are needed. Missing parts become '' rather than NaN,
+        # because pandas joins NaN keys to NaN keys and would match rows without an Entry Name
+        split_sseqid = merge_results['sseqid'].str.split('|', n=2, expand=True).reindex(columns=range(3)).fillna('')
+        merge_results['sseqid_1'] = split_sseqid[0]
+        merge_results['sseqid_2'] = split_sseqid[1]
+        merge_results['sseqid_3'] = split_sseqid[2]
+    else:
+        raise ValueError("Column 'sseqid' not found in merge_results.tsv")
 
-# Overwrite the original merge_results file with the updated version
-merge_results.to_csv(args.merge_results, sep='\t', index=False)
+    # Overwrite the original merge_results file with the updated version
+    merge_results.to_csv(merge_results_path, sep='\t', index=False)
 
-# Clean uniprot_map: Remove duplicate header rows (except the first)
-with open(args.uniprot_map, 'r') as f:
-    lines = f.readlines()
+    # Load uniprot_map and drop any repeated header rows (except the first)
+    uniprot_map = read_table(uniprot_map_path)
+    uniprot_map = uniprot_map[uniprot_map.iloc[:, 0] != uniprot_map.columns[0]]
 
-# Identify the first header line
-header = lines[0].strip().split('\t')
+    # Strip spaces and force lowercase for better matching
+    left_key = merge_results['sseqid_3'].str.strip().str.lower()
+    right_key = uniprot_map['Entry Name'].str.strip().str.lower()
 
-# Remove rows that exactly match the header (except the first)
-cleaned_lines = [lines[0]] + [line for line in lines[1:] if line.strip().split('\t') != header]
+    # Encode both keys with one shared category set so the join runs on integer codes
+    key_dtype = pd.CategoricalDtype(pd.Index(left_key.dropna().unique()).union(right_key.dropna().unique()))
+    merge_results['sseqid_3'] = left_key.astype(key_dtype)
+    uniprot_map['Entry Name'] = right_key.astype(key_dtype)
 
-# Write back the cleaned file
-with open(args.uniprot_map, 'w') as f:
-    f.writelines(cleaned_lines)
+    # Merge using LEFT JOIN to keep all rows from merge_results
+    merged_df = pd.merge(merge_results, uniprot_map, left_on='sseqid_3', right_on='Entry Name', how='left')
 
-# Load cleaned uniprot_map into a DataFrame
-uniprot_map = pd.read_csv(args.uniprot_map, sep='\t')
+    # Back to plain strings so missing keys can be filled below
+    merged_df['sseqid_3'] = merged_df['sseqid_3'].astype(object)
+    merged_df['Entry Name'] = merged_df['Entry Name'].astype(object)
 
-# Strip spaces and force lowercase for better matching
-merge_results['sseqid_3'] = merge_results['sseqid_3'].str.strip().str.lower()
-uniprot_map['Entry Name'] = uniprot_map['Entry Name'].str.strip().str.lower()
+    # Sort rows based on the first column
+    merged_df = merged_df.sort_values(by=merged_df.columns[0])
 
-# Merge using LEFT JOIN to keep all rows from merge_results
-merged_df = pd.merge(merge_results, uniprot_map, left_on='sseqid_3', right_on='Entry Name', how='left')
+    # List of columns to remove
+    columns_to_remove = ['ssciname', 'staxid', 'Name', 'Alias/Synonyms', 'EC_number', 'BUSCO', 
+                         'InterPro', 'EggNog', 'COG', 'GO Terms', 'Secreted', 'Membrane', 
+                         'Protease', 'CAZyme', 'Notes']
 
-# Sort rows based on the first column
-merged_df = merged_df.sort_values(by=merged_df.columns[0])
+    # Remove specified columns if they exist
+    merged_df = merged_df.drop(columns=[col for col in columns_to_remove if col in merged_df.columns])
 
-# List of columns to remove
-columns_to_remove = ['ssciname', 'staxid', 'Name', 'Alias/Synonyms', 'EC_number', 'BUSCO', 
-                     'InterPro', 'EggNog', 'COG', 'GO Terms', 'Secreted', 'Membrane', 
-                     'Protease', 'CAZyme', 'Notes']
+    # Replace empty values with 'no information'
+    merged_df = merged_df.fillna('no information')
 
-# Remove specified columns if they exist
-merged_df = merged_df.drop(columns=[col for col in columns_to_remove if col in merged_df.columns])
+    # Drop duplicate rows based on the first column (Unique ID)
+    merged_df = merged_df.drop_duplicates(subset=merged_df.columns[0], keep='first')
 
-# Replace empty values with 'no information'
-merged_df = merged_df.fillna('no information')
+    # Save final merged file
+    merged_df.to_csv(output, sep='\t', index=False)
 
-# Drop duplicate rows based on the first column (Unique ID)
-merged_df = merged_df.drop_duplicates(subset=merged_df.columns[0], keep='first')
+    print(f"Duplicate header rows removed from uniprot_map.tsv! Unique lines based on Unique ID merged correctly. Output saved to {output}")
+    return merged_df
 
-# Save final merged file
-merged_df.to_csv(args.output, sep='\t', index=False)
 
-print(f"Duplicate header rows removed from uniprot_map.tsv! Unique lines based on Unique ID merged correctly. Output saved to {args.output}")
+if __name__ == "__main__":
+    # Set up command-line argument parsing
+    parser = argparse.ArgumentParser(description="Merge two TSV files on specified columns.")
+    parser.add_argument("merge_results", help="Path to the merge_results.tsv file.")
+    parser.add_argument("uniprot_map", help="Path to the uniprot_map.tsv file.")
+    parser.add_argument("output", help="Path to save the merged output file.")
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    try:
+        run(args.merge_results, args.uniprot_map, args.output)
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(1)
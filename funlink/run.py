@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 
 
-import subprocess
 import argparse
 import os
 
+# Pipeline steps live next to this script and are called in-process
+import uniq_id
+import fetch
+import merge
+import storage
+
 print("""
 ==========================================================================================
                                     FUNLINK V.2
@@ -44,38 +49,24 @@ parser.add_argument("--annotation_file", type=str, required=True, help="Path to
 # Parse arguments
 args = parser.parse_args()
 
+merged_results_path = os.path.join(immediate_path, "merged_results.tsv")
+uniprot_ids_path = os.path.join(immediate_path, "uniprot_ids.txt")
+uniprot_map_path = os.path.join(immediate_path, "uniprot_map.tsv")
+draft_db_path = os.path.join(immediate_path, "draft_db.tsv")
+
 # 1. Create BLAST database and run search (with added annotation file)
-uniq_id_command = [
-    "python", os.path.join(program_path, "uniq_id.py"),
-    "--protein_fasta", args.protein_fasta,
-    "--output_db", args.output_db,
-    "--query_fasta", args.query_fasta, 
-    "--blast_output", os.path.join(immediate_path, "blast_results.tsv"),
-    "--merged_output", os.path.join(immediate_path, "merged_results.tsv"),
-    "--annotation_file", args.annotation_file,
-    "--uniprot_output", os.path.join(immediate_path, "uniprot_ids.txt")
-]
-
-# Run the command
-subprocess.run(uniq_id_command, check=True)
+merged_df = uniq_id.run(
+    args.protein_fasta, args.output_db, args.query_fasta, args.annotation_file,
+    blast_output=os.path.join(immediate_path, "blast_results.tsv"),
+    merged_output=merged_results_path,
+    uniprot_output=uniprot_ids_path,
+)
 
 # 2. Link to other db using API
-fetch_command = [
-    "python", os.path.join(program_path, "fetch.py"), os.path.join(immediate_path, "uniprot_ids.txt"), os.path.join(immediate_path, "uniprot_map.txt"),
-
-]
-
-# Run the command
-subprocess.run(fetch_command, check=True)
-
-# 3. Merge the linked output with previous annnotation
-merge_command = [
-    "python", os.path.join(program_path, "merge.py"), os.path.join(immediate_path, "merged_results.tsv"), os.path.join(immediate_path, "uniprot_map.tsv"), os.path.join(immediate_path, "draft_db.tsv"),
+fetch.main(uniprot_ids_path, uniprot_map_path)
 
-]   
-
-# Run the command
-subprocess.run(merge_command, check=True)
+# 3. Merge the linked output with previous annnotation (reusing the in-memory BLAST merge)
+merge.run(merged_results_path, uniprot_map_path, draft_db_path, merge_results=merged_df)
 
 print(f"Draft database is established")
 species = input("Please enter the species name for indexing the database: ")
@@ -83,16 +74,4 @@ condition = input(" Please enter the condition for indexing the database: ")
 isolate = input("Please enter the ioslate name to be the key for searching database (should use the unique name without space): ")
  
 # 4. Storing the database
-storage_command = [
-    "python", os.path.join(program_path, "storage.py"), 
-    "--species", species,  # Use the variable from input()
-    "--condition", condition,  # Use the variable from input()
-    "--isolate", isolate,  # Use the variable from input()
-    "--db_dir", final_path,  # Use the final_path variable
-    os.path.join(immediate_path, "draft_db.tsv"),
-]
-
-# Run the command
-subprocess.run(storage_command, check=True)
-
-
+storage.run([draft_db_path], species, condition, isolate, final_path)
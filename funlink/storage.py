@@ -1,11 +1,26 @@
 #!/usr/bin/env python
 
 import os
-import pandas as pd
+import numpy as np
 import sqlite3
-import zlib
 import bz2
+import shutil
 import argparse
+import csv
+from tsv_io import read_table
+
+COPY_BUFFER_SIZE = 4 * 1024 * 1024  # Stream bz2 data in 4 MiB chunks
+WRITE_BUFFER_SIZE = 1 << 20  # 1 MiB buffer for metadata writes
+METADATA_HEADER = ["id", "table_name", "species", "condition", "isolate"]
+
+# Map pandas data types to SQLite column types; anything else is stored as TEXT
+TYPE_MAP = {
+    np.dtype("O"): "TEXT",  # String columns, stored uncompressed (bzip2 covers the whole database)
+    np.dtype("int64"): "INTEGER",  # Integer columns
+    np.dtype("float64"): "REAL",  # Float columns
+}
+
+_next_metadata_id = {}  # metadata_file -> id for the next entry, counted once per run
 
 def decompress_database(db_path):
     """
@@ -15,7 +30,7 @@ def decompress_database(db_path):
     if os.path.exists(bz2_path):
         print(f"📂 Found compressed database. Decompressing {bz2_path}...")
         with bz2.BZ2File(bz2_path, 'rb') as bz2_file, open(db_path, 'wb') as db_file:
-            db_file.write(bz2_file.read())
+            shutil.copyfileobj(bz2_file, db_file, length=COPY_BUFFER_SIZE)
         print(f"✅ Decompressed database to {db_path}")
 
 def compress_database(db_path):
@@ -25,38 +40,15 @@ def compress_database(db_path):
     bz2_path = db_path + ".bz2"
     
     with open(db_path, 'rb') as db_file, bz2.BZ2File(bz2_path, 'wb') as bz2_file:
-        bz2_file.write(db_file.read())
+        shutil.copyfileobj(db_file, bz2_file, length=COPY_BUFFER_SIZE)
 
     os.remove(db_path)  # Remove original uncompressed database
     print(f"📦 Database compressed to {bz2_path} and original removed.")
 
-def compress_column(df):
-    """
-    Compress all columns that contain string data (likely large text or sequences).
-    """
-    for col in df.columns:
-        if df[col].dtype == 'object':  # Check if the column is of type 'object' (string in pandas)
-            print(f"💾 Compressing column: {col}")
-            df[col] = df[col].apply(lambda x: zlib.compress(x.encode('utf-8')) if isinstance(x, str) else x)
-    return df
-
-def detect_column_type(column):
-    """
-    Detect the column type for SQLite storage. This will map pandas data types to SQLite types.
-    """
-    if column.dtype == 'object':  # String columns
-        return "BLOB"
-    elif column.dtype == 'int64':  # Integer columns
-        return "INTEGER"
-    elif column.dtype == 'float64':  # Float columns
-        return "REAL"
-    else:
-        return "TEXT"  # Default to TEXT for other cases
-
 def store_table(conn, cursor, table_name, df, species, condition, isolate, metadata_file):
     """
     Stores a Pandas DataFrame into the SQLite database efficiently.
-    Automatically compresses string columns and updates metadata file.
+    Text is stored as-is (compression happens once over the whole .bz2 file) and the metadata file is updated.
     """
     if 'isolate' not in df.columns:
         df['isolate'] = isolate  
@@ -64,45 +56,52 @@ def store_table(conn, cursor, table_name, df, species, condition, isolate, metad
     df['condition'] = condition  
 
     cursor.execute("PRAGMA journal_mode=WAL;")  
-    cursor.execute("PRAGMA synchronous=NORMAL;")  
+    cursor.execute("PRAGMA synchronous=OFF;")  # The .bz2 copy is untouched until recompression
     cursor.execute("PRAGMA cache_size=-100000;")  
     cursor.execute("PRAGMA temp_store=MEMORY;")  
 
     df = df.drop_duplicates()
-    df = compress_column(df)  # Apply zlib compression to text columns
 
-    columns = [f'"{col}" {detect_column_type(df[col])}' for col in df.columns]
+    columns = [f'"{col}" {TYPE_MAP.get(dtype, "TEXT")}' for col, dtype in zip(df.columns, df.dtypes)]
     create_table_sql = f'CREATE TABLE IF NOT EXISTS "{table_name}" (id INTEGER PRIMARY KEY AUTOINCREMENT, {", ".join(columns)})'
     cursor.execute(create_table_sql)
 
-    df.to_sql(table_name, conn, if_exists="append", index=False, chunksize=500)
+    # Bulk insert every row in a single transaction
+    column_names = ", ".join(f'"{col}"' for col in df.columns)
+    placeholders = ", ".join("?" * len(df.columns))
+    insert_sql = f'INSERT INTO "{table_name}" ({column_names}) VALUES ({placeholders})'
+    values = df.astype(object).where(df.notna(), None)  # Store missing values as NULL
+    cursor.execute("BEGIN;")
+    try:
+        cursor.executemany(insert_sql, values.itertuples(index=False, name=None))
+        cursor.execute("COMMIT;")
+    except Exception:
+        cursor.execute("ROLLBACK;")
+        raise
     print(f"✅ Stored {table_name} successfully!")
 
     add_metadata_entry(metadata_file, table_name, species, condition, isolate)
 
-    cursor.execute("VACUUM;")  
-    conn.commit()
-    print(f"🔍 Optimized {table_name} storage")
-
 def add_metadata_entry(metadata_file, table_name, species, condition, isolate):
     """
-    Adds an entry to the metadata file that tracks the database tables.
+    Appends an entry to the metadata file that tracks the database tables.
     """
-    if not os.path.exists(metadata_file):
-        metadata_df = pd.DataFrame(columns=["id", "table_name", "species", "condition", "isolate"])
-        metadata_df.to_csv(metadata_file, sep="\t", index=False)
-
-    metadata_df = pd.read_csv(metadata_file, sep="\t")
-    new_entry = {
-        "id": len(metadata_df) + 1,
-        "table_name": table_name,
-        "species": species,
-        "condition": condition,
-        "isolate": isolate
-    }
-    
-    metadata_df = metadata_df.append(new_entry, ignore_index=True)
-    metadata_df.to_csv(metadata_file, sep="\t", index=False)
+    new_file = not os.path.exists(metadata_file) or os.path.getsize(metadata_file) == 0
+
+    if metadata_file not in _next_metadata_id:
+        if new_file:
+            _next_metadata_id[metadata_file] = 1
+        else:
+            with open(metadata_file, "r") as f:
+                _next_metadata_id[metadata_file] = sum(1 for _ in f)  # Header line + existing entries
+
+    entry_id = _next_metadata_id[metadata_file]
+    with open(metadata_file, "a", newline="", buffering=WRITE_BUFFER_SIZE) as f:
+        writer = csv.writer(f, delimiter="\t")
+        if new_file:
+            writer.writerow(METADATA_HEADER)
+        writer.writerow([entry_id, table_name, species, condition, isolate])
+    _next_metadata_id[metadata_file] = entry_id + 1
 
     print(f"📋 Added metadata for table: {table_name}")
 
@@ -115,9 +114,9 @@ def process_file(conn, cursor, filepath, species, condition, isolate, metadata_f
         return
     
     if filepath.endswith(".csv"):
-        df = pd.read_csv(filepath)
+        df = read_table(filepath, delimiter=",")
     elif filepath.endswith(".tsv") or filepath.endswith(".txt"):
-        df = pd.read_csv(filepath, sep="\t")
+        df = read_table(filepath)
     else:
         print(f"❌ Unsupported file format: {filepath}")
         return
@@ -125,30 +124,25 @@ def process_file(conn, cursor, filepath, species, condition, isolate, metadata_f
     table_name = f"{species}_{condition}_{isolate}"
     store_table(conn, cursor, table_name, df, species, condition, isolate, metadata_file)
 
-# Command-line argument parsing
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Efficiently store tables in SQLite and compress final database with bzip2.")
-    parser.add_argument("files", nargs="+", help="Path to one or more CSV/TSV files.")
-    parser.add_argument("--species", required=True, help="Species name for tracking")
-    parser.add_argument("--condition", required=True, help="Condition for tracking")
-    parser.add_argument("--isolate", required=True, help="Isolate name for tracking")
-    parser.add_argument("--db_dir", default=os.getcwd(), help="Directory to store the database and metadata file")
-    
-    args = parser.parse_args()
-    
-    os.makedirs(args.db_dir, exist_ok=True)
+def run(files, species, condition, isolate, db_dir):
+    """
+    Stores each file as a table in the database under db_dir and recompresses it.
+    """
+    os.makedirs(db_dir, exist_ok=True)
     
-    db_path = os.path.join(args.db_dir, "efficient_data_storage.db")
-    metadata_file = os.path.join(args.db_dir, "metadata_tracking.tsv")
+    db_path = os.path.join(db_dir, "efficient_data_storage.db")
+    metadata_file = os.path.join(db_dir, "metadata_tracking.tsv")
 
     decompress_database(db_path)  # Unzip database if exists
     
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)  # Transactions are managed explicitly in store_table
     cursor = conn.cursor()
     
-    for file in args.files:
-        process_file(conn, cursor, file, args.species, args.condition, args.isolate, metadata_file)
+    for file in files:
+        process_file(conn, cursor, file, species, condition, isolate, metadata_file)
     
+    cursor.execute("VACUUM;")  # Rebuild the database once after all tables are loaded
+    print("🔍 Optimized database storage")
     conn.close()
     print(f"📁 Database stored at: {db_path}")
 
@@ -156,3 +150,16 @@ if __name__ == "__main__":
 
     print(f"📋 Metadata tracked in: {metadata_file}")
     print("📁 Database connection closed.")
+
+# Command-line argument parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Efficiently store tables in SQLite and compress final database with bzip2.")
+    parser.add_argument("files", nargs="+", help="Path to one or more CSV/TSV files.")
+    parser.add_argument("--species", required=True, help="Species name for tracking")
+    parser.add_argument("--condition", required=True, help="Condition for tracking")
+    parser.add_argument("--isolate", required=True, help="Isolate name for tracking")
+    parser.add_argument("--db_dir", default=os.getcwd(), help="Directory to store the database and metadata file")
+    
+    args = parser.parse_args()
+    
+    run(args.files, args.species, args.condition, args.isolate, args.db_dir)
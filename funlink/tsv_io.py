@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+except ImportError:  # pyarrow is optional; fall back to the pandas parser
+    pa = None
+
+
+def read_table(path, delimiter="\t", column_names=None, encoding="utf-8", usecols=None):
+    """
+    Reads a delimited file with pyarrow's multithreaded parser, falling back to pandas.
+
+    pyarrow infers each column's type from the first block only, so a column that is empty
+    or numeric there and holds something else later fails to convert; pandas handles those files.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Missing input file: {path}")
+    if pa is not None:
+        read_options = pacsv.ReadOptions(column_names=column_names, encoding=encoding, block_size=1 << 22)
+        parse_options = pacsv.ParseOptions(delimiter=delimiter)
+        try:
+            # pandas keeps dates such as "2005-05-24" as text; find them in the first block and read them as strings
+            schema = pacsv.open_csv(path, read_options=read_options, parse_options=parse_options,
+                                    convert_options=pacsv.ConvertOptions(strings_can_be_null=True,
+                                                                         include_columns=usecols or [])).schema
+            text_types = {field.name: pa.string() for field in schema if pa.types.is_temporal(field.type)}
+            table = pacsv.read_csv(path, read_options=read_options, parse_options=parse_options,
+                                   convert_options=pacsv.ConvertOptions(strings_can_be_null=True,
+                                                                        include_columns=usecols or [],
+                                                                        column_types=text_types))
+            return table.to_pandas()
+        except pa.ArrowInvalid:
+            print(f"Column types in {path} change after the first block; reading with pandas instead")
+    return pd.read_csv(path, sep=delimiter, names=column_names, encoding=encoding, usecols=usecols)
@@ -3,6 +3,8 @@
 import argparse
 import os
 import subprocess
+import shutil
+import tempfile
 import pandas as pd
 import numpy as np
 import requests
@@ -18,12 +20,39 @@ import joblib
 import warnings
 warnings.filterwarnings('ignore')
 import time
+from tsv_io import read_table
 
 
 # BLAST Pipeline Functions
 
+def _stamp(*paths):
+    """Fingerprint input files by size and modification time."""
+    parts = []
+    for path in paths:
+        st = os.stat(path)
+        parts.append(f"{os.path.abspath(path)}:{st.st_size}-{int(st.st_mtime)}")
+    return "\n".join(parts)
+
+def _is_current(sidecar, stamp):
+    """Check whether a step's sidecar records the same input stamp."""
+    if not os.path.exists(sidecar):
+        return False
+    with open(sidecar, "r") as f:
+        return f.read() == stamp
+
+def _write_stamp(sidecar, stamp):
+    """Record the input stamp of a step that completed successfully."""
+    with open(sidecar, "w") as f:
+        f.write(stamp)
+
 def make_blast_db(protein_fasta, output_db):
-    """Create a BLAST protein database."""
+    """Create a BLAST protein database, skipping it when protein_fasta is unchanged since the last build."""
+    sidecar = output_db + ".stamp"
+    stamp = _stamp(protein_fasta)
+    db_built = os.path.exists(output_db + ".pin") or os.path.exists(output_db + ".pal")  # Single or multi-volume
+    if db_built and _is_current(sidecar, stamp):
+        print(f"BLAST database is up to date, skipping makeblastdb: {output_db}")
+        return
     cmd = [
         "makeblastdb",
         "-in", protein_fasta,
@@ -32,43 +61,88 @@ def make_blast_db(protein_fasta, output_db):
     ]
     print(f"Running: {' '.join(cmd)}")
     subprocess.run(cmd, check=True)
+    _write_stamp(sidecar, stamp)
+
+def split_fasta(fasta_file, num_shards, shard_dir):
+    """Split a FASTA file into up to num_shards contiguous shards with roughly equal record counts."""
+    with open(fasta_file, "r") as f:
+        num_records = sum(1 for line in f if line.startswith(">"))
+    num_shards = max(1, min(num_shards, num_records))
+    per_shard = -(-num_records // num_shards)  # Ceiling division
+
+    shard_files = []
+    out = None
+    record_index = -1
+    with open(fasta_file, "r") as f:
+        for line in f:
+            if line.startswith(">"):
+                record_index += 1
+                if record_index % per_shard == 0:  # Start the next shard
+                    if out:
+                        out.close()
+                    shard_files.append(os.path.join(shard_dir, f"shard_{len(shard_files)}.fasta"))
+                    out = open(shard_files[-1], "w")
+            if out:
+                out.write(line)
+    if out:
+        out.close()
+    return shard_files
 
 def run_blastp(db_path, query_fasta, output_file):
-    """Run BLASTP search with proper parameters."""
-    cmd = [
+    """
+    Run BLASTP search with proper parameters, one single-threaded process per query shard.
+    Skipped when the query and database are unchanged since the previous successful run.
+    """
+    final_output = output_file if output_file.endswith(".tsv") else output_file + ".tsv"
+    sidecar = final_output + ".stamp"
+    db_sidecar = db_path + ".stamp"
+    stamp = _stamp(query_fasta, *([db_sidecar] if os.path.exists(db_sidecar) else []))
+    if os.path.exists(final_output) and _is_current(sidecar, stamp):
+        print(f"BLAST results are up to date, skipping blastp: {final_output}")
+        return final_output
+
+    base_cmd = [
         "blastp",
         "-db", db_path,
-        "-query", query_fasta,  # Corrected variable name
         "-outfmt", "6 qseqid sseqid qstart qend sstart send pident evalue ssciname staxid",
-        "-out", output_file,
         "-max_target_seqs", "1",
-        "-num_threads", str(os.cpu_count())
+        "-num_threads", "1"
     ]
-    print(f"Running: {' '.join(cmd)}")
-    try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"BLASTP failed: {str(e)}") from e
+
+    # BLASTP's own threading stops scaling after a few cores, so shard the queries instead
+    with tempfile.TemporaryDirectory() as shard_dir:
+        shards = split_fasta(query_fasta, os.cpu_count() or 1, shard_dir)
+        procs = []
+        for shard in shards:
+            cmd = base_cmd + ["-query", shard, "-out", shard + ".tsv"]
+            print(f"Running: {' '.join(cmd)}")
+            procs.append(subprocess.Popen(cmd))
+
+        failed = [proc.args for proc in procs if proc.wait() != 0]
+        if failed:
+            raise RuntimeError(f"BLASTP failed: {' '.join(failed[0])}")
+
+        # Concatenate shard results in query order
+        with open(output_file, "wb") as out:
+            for shard in shards:
+                with open(shard + ".tsv", "rb") as part:
+                    shutil.copyfileobj(part, out)
 
     if not os.path.exists(output_file):
         raise FileNotFoundError(f"BLAST output file not created: {output_file}")
     
     if not output_file.endswith(".tsv"):
-        tsv_output_file = output_file + ".tsv"
-        os.rename(output_file, tsv_output_file)
-        print(f"Output renamed to: {tsv_output_file}")
-        return tsv_output_file
-    return output_file
+        os.replace(output_file, final_output)
+        print(f"Output renamed to: {final_output}")
+    _write_stamp(sidecar, stamp)
+    return final_output
 
 def merge_files(blast_output, annotation_file, output_file, key1="qseqid", key2="TranscriptID", encoding="utf-8"):
-    """Merge BLAST output with annotation file."""
-    try:
-        blast_cols = ["qseqid", "sseqid", "qstart", "qend", "sstart", "send",
-                     "pident", "evalue", "ssciname", "staxid"]
-        blast_df = pd.read_csv(blast_output, sep="\t", names=blast_cols, encoding=encoding)
-        annotation_df = pd.read_csv(annotation_file, sep="\t", encoding=encoding)
-    except FileNotFoundError as e:
-        raise FileNotFoundError(f"Missing input file: {e.filename}") from e
+    """Merge BLAST output with annotation file and return the merged DataFrame."""
+    blast_cols = ["qseqid", "sseqid", "qstart", "qend", "sstart", "send",
+                 "pident", "evalue", "ssciname", "staxid"]
+    blast_df = read_table(blast_output, column_names=blast_cols, encoding=encoding)
+    annotation_df = read_table(annotation_file, encoding=encoding)
 
     # Validate merge keys
     if key1 not in blast_df.columns:
@@ -79,26 +153,40 @@ def merge_files(blast_output, annotation_file, output_file, key1="qseqid", key2=
     merged_df = pd.merge(blast_df, annotation_df, left_on=key1, right_on=key2, how="left")
     merged_df.to_csv(output_file, sep="\t", index=False)
     print(f"Merged file saved to: {output_file}")
-    return output_file
-
-def extract_uniprot_ids(merged_file, uniprot_id_file):
-    """Extract UniProt IDs from merged file."""
-    if not os.path.exists(merged_file):
-        raise FileNotFoundError(f"Merged file not found: {merged_file}")
-    
-    df = pd.read_csv(merged_file, sep="\t")
-    
-    if 'sseqid' not in df.columns:
+    return merged_df
+
+def extract_uniprot_ids(merged_file, uniprot_id_file, merged_df=None):
+    """Extract UniProt IDs from merged file, or from merged_df when it is already in memory."""
+    if merged_df is None:
+        if not os.path.exists(merged_file):
+            raise FileNotFoundError(f"Merged file not found: {merged_file}")
+        with open(merged_file, "r") as f:
+            if 'sseqid' not in f.readline().rstrip("\r\n").split("\t"):
+                raise ValueError("Column 'sseqid' not found in merged file")
+        merged_df = read_table(merged_file, usecols=['sseqid'])  # Only the ID column is needed
+    elif 'sseqid' not in merged_df.columns:
         raise ValueError("Column 'sseqid' not found in merged file")
     
-    # Extract the UniProt IDs and save to output file
-    uniprot_ids = df['sseqid'].str.split('|').str[1].dropna()
+    # Extract the unique UniProt IDs (second '|' field of sseqid) and save to output file
+    uniprot_ids = merged_df['sseqid'].str.extract(r'^[^|]*\|([^|]*)', expand=False).dropna().drop_duplicates()
     uniprot_ids.to_csv(uniprot_id_file, index=False, header=False)  # Save without index and header
     print(f"UniProt IDs saved to: {uniprot_id_file}")
     
     return uniprot_id_file
 
 
+def run(protein_fasta, output_db, query_fasta, annotation_file,
+        blast_output="blast_results.tsv", merged_output="merged_results.tsv", uniprot_output="uniprot_data.tsv"):
+    """Run the BLAST pipeline and return the merged DataFrame."""
+    print("Running BLAST pipeline...")
+    make_blast_db(protein_fasta, output_db)
+    blast_out = run_blastp(output_db, query_fasta, blast_output)
+    merged_df = merge_files(blast_out, annotation_file, merged_output)
+    extract_uniprot_ids(merged_output, uniprot_output, merged_df)
+    print("\nBLAST pipeline completed successfully!")
+    return merged_df
+
+
 #Main Function
 
 def main():
@@ -126,12 +214,8 @@ def main():
 
     # Run BLAST pipeline
     try:
-        print("Running BLAST pipeline...")
-        make_blast_db(args.protein_fasta, args.output_db)
-        blast_out = run_blastp(args.output_db, args.query_fasta, args.blast_output)
-        merge_files(blast_out, args.annotation_file, args.merged_output)
-        id_file = extract_uniprot_ids(args.merged_output, args.uniprot_output)
-        print("\nBLAST pipeline completed successfully!")
+        run(args.protein_fasta, args.output_db, args.query_fasta, args.annotation_file,
+            args.blast_output, args.merged_output, args.uniprot_output)
     except Exception as e:
         print(f"\nPipeline failed: {str(e)}")
         return
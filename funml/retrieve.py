@@ -1,53 +1,126 @@
 #!/usr/bin/env python
 
 import sqlite3
+import pathlib
 import pandas as pd
 import zlib
 import bz2
 import os
+import shutil
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+except ImportError:  # pyarrow is optional; fall back to pandas.to_csv
+    pa = None
+
+COPY_BUFFER_SIZE = 4 * 1024 * 1024  # Stream bz2 data in 4 MiB chunks
+READ_CHUNK_SIZE = 100_000  # Rows fetched per chunk from the database
+DECOMPRESS_SLICE_SIZE = 10_000  # Values decompressed per worker task
+DECOMPRESS_WORKERS = os.cpu_count() or 1
+
+def fadvise(f, advice_name):
+    """
+    Passes a page-cache hint for an open file to the kernel where posix_fadvise is supported.
+    """
+    advice = getattr(os, advice_name, None)
+    if advice is not None and hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(f.fileno(), 0, 0, advice)
 
 def decompress_database(db_path):
     """
-    Decompresses a .bz2 database if it exists.
+    Decompresses a .bz2 database if it exists, unless an up-to-date copy is already there.
     """
     bz2_path = db_path + ".bz2"
     if os.path.exists(bz2_path):
+        if (os.path.exists(db_path) and os.path.getsize(db_path) > 0
+                and os.path.getmtime(db_path) >= os.path.getmtime(bz2_path)):
+            print(f"✅ Using existing decompressed database {db_path}")
+            return
         print(f"📂 Found compressed database. Decompressing {bz2_path}...")
-        with bz2.BZ2File(bz2_path, 'rb') as bz2_file, open(db_path, 'wb') as db_file:
-            db_file.write(bz2_file.read())
+        tmp_path = db_path + ".tmp"  # Renamed into place only once complete
+        with open(bz2_path, 'rb') as raw, bz2.BZ2File(raw, 'rb') as bz2_file, open(tmp_path, 'wb') as db_file:
+            fadvise(raw, "POSIX_FADV_SEQUENTIAL")  # Read-ahead for the compressed input
+            shutil.copyfileobj(bz2_file, db_file, length=COPY_BUFFER_SIZE)
+            fadvise(raw, "POSIX_FADV_DONTNEED")  # Compressed pages are not needed again
+        os.replace(tmp_path, db_path)
         print(f"✅ Decompressed database to {db_path}")
 
+def _decompress_values(values):
+    """
+    Decompresses one slice of a column; zlib releases the GIL while inflating, so slices run in parallel.
+    """
+    _decompress = zlib.decompress
+    return [_decompress(v).decode('utf-8') if isinstance(v, bytes) else v for v in values]
+
 def decompress_column(df):
     """
-    Decompress all columns that were compressed (i.e., of type 'object' and compressed).
+    Decompress all columns that were compressed (i.e., of type 'object' holding bytes).
     """
-    for col in df.columns:
-        if df[col].dtype == 'object':  # Check if the column is of type 'object' (string in pandas)
-            print(f"💾 Decompressing column: {col}")
-            df[col] = df[col].apply(lambda x: zlib.decompress(x).decode('utf-8') if isinstance(x, bytes) else x)
+    with ThreadPoolExecutor(max_workers=DECOMPRESS_WORKERS) as executor:
+        for col in df.columns:
+            if df[col].dtype == 'object':  # Check if the column is of type 'object' (string in pandas)
+                values = df[col].to_numpy(copy=False)
+                first = next((v for v in values if isinstance(v, (bytes, str))), None)  # First non-null value
+                if not isinstance(first, bytes):  # Stored as plain text; nothing to decompress
+                    continue
+                print(f"💾 Decompressing column: {col}")
+                slices = [values[i:i + DECOMPRESS_SLICE_SIZE] for i in range(0, len(values), DECOMPRESS_SLICE_SIZE)]
+                df[col] = [v for part in executor.map(_decompress_values, slices) for v in part]
     return df
 
-def retrieve_data_from_db(db_file, species, condition, isolate):
+def connect_readonly(db_file):
+    """
+    Opens the SQLite database read-only with pragmas tuned for full-table scans.
+    """
+    uri = pathlib.Path(db_file).resolve().as_uri() + "?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True)
+    conn.executescript("PRAGMA mmap_size=268435456; PRAGMA cache_size=-262144; "
+                       "PRAGMA temp_store=MEMORY; PRAGMA query_only=1;")
+    return conn
+
+def table_columns(conn, table_name):
+    """
+    Returns the (name, declared type) pairs of a table's columns.
+    """
+    return [(row[1], row[2]) for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
+
+def retrieve_data_from_db(db_file, species, condition, isolate, columns=None):
     """
     Retrieves data from the SQLite database for the given species, condition, and isolate.
+    Only the given columns are read when columns is set.
     """
     # Decompress the database if it's compressed
     decompress_database(db_file)
 
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+    # Connect to the SQLite database (read-only)
+    conn = connect_readonly(db_file)
 
     # Construct the table name based on the given keys
     table_name = f"{species}_{condition}_{isolate}"
 
+    # Project only the requested columns
+    declared_types = dict(table_columns(conn, table_name))
+    if not declared_types:
+        conn.close()
+        raise ValueError(f"Table not found in database: {table_name}")
+    selected = list(columns) if columns else list(declared_types)
+    unknown = [col for col in selected if col not in declared_types]
+    if unknown:
+        conn.close()
+        raise ValueError(f"Columns not found in {table_name}: {', '.join(unknown)}")
+
     # Query to retrieve the data
-    query = f"SELECT * FROM '{table_name}'"
-    df = pd.read_sql(query, conn)
+    column_list = ", ".join(f'"{col}"' for col in selected)
+    query = f'SELECT {column_list} FROM "{table_name}"'
 
-    # Decompress any columns that were compressed
-    df = decompress_column(df)
+    # Tables written before text was stored uncompressed (BLOB columns) need each chunk decompressed
+    compressed = any(declared_types[col].upper() == "BLOB" for col in selected)
+    chunks = pd.read_sql(query, conn, chunksize=READ_CHUNK_SIZE)
+    chunks = [decompress_column(chunk) for chunk in chunks] if compressed else list(chunks)
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=selected)
 
     # Close the database connection
     conn.close()
@@ -65,8 +138,20 @@ def save_data_to_tsv(df, output_dir, species, condition, isolate):
         # Generate the full file path
         output_file = os.path.join(output_dir, f"{species}_{condition}_{isolate}_retrieved_data.tsv")
         
-        # Save the DataFrame to a TSV file
-        df.to_csv(output_file, sep="\t", index=False)
+        # Save the DataFrame to a TSV file. pyarrow's C++ writer is only used for text and integer
+        # columns, where its unquoted output matches pandas (it formats floats and booleans differently)
+        same_output = all(dtype == object or pd.api.types.is_integer_dtype(dtype) for dtype in df.dtypes)
+        if pa is not None and same_output:
+            try:
+                write_options = pacsv.WriteOptions(delimiter="\t", quoting_style="none", quoting_header="none")
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                pacsv.write_csv(table, output_file, write_options=write_options)
+            # Mixed types or values that would need quoting; TypeError also covers pyarrow
+            # releases whose WriteOptions has no quoting_header (ArrowTypeError is a subclass)
+            except (pa.ArrowInvalid, TypeError):
+                df.to_csv(output_file, sep="\t", index=False)
+        else:
+            df.to_csv(output_file, sep="\t", index=False)
         print(f"📁 Retrieved data saved to {output_file}")
     else:
         print("❌ No data to save.")
@@ -79,11 +164,12 @@ if __name__ == "__main__":
     parser.add_argument("--isolate", required=True, help="Isolate for retrieving data")
     parser.add_argument("--db_file", required=True, help="Path to the SQLite database file")
     parser.add_argument("--output_dir", required=True, help="Directory to save the retrieved data")
+    parser.add_argument("--columns", nargs="+", help="Only retrieve these columns (default: all)")
 
     args = parser.parse_args()
 
     # Retrieve the data from the database
-    df = retrieve_data_from_db(args.db_file, args.species, args.condition, args.isolate)
+    df = retrieve_data_from_db(args.db_file, args.species, args.condition, args.isolate, args.columns)
 
     # Save the data as a .tsv file
     save_data_to_tsv(df, args.output_dir, args.species, args.condition, args.isolate)